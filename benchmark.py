@@ -0,0 +1,262 @@
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+# Benchmarks run offline on their own store; the background refresh and prerendering would only add noise.
+os.environ.setdefault('REFRESH_INTERVAL', '0')
+os.environ.setdefault('PRERENDER_REGIONS', '')
+os.environ.setdefault('PRERENDER_TOP', '0')
+os.environ.setdefault('DATA_STORE', os.path.join(tempfile.mkdtemp(prefix='benchmark-'), 'allData.arrow'))
+
+import numpy as np
+import pandas as pd
+from plotly.io.json import to_json_plotly
+import loaders
+from generate_data import global_frames, us_frames
+
+# Imported by the command line below, once COVID_SOURCE points at the fixture files.
+main = None
+
+bundledPickle = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'allData.pkl')
+defaultRegions = [('US', '<all>'), ('US', 'California'), ('China', 'Hubei'), ('Germany', '<all>')]
+
+
+def legacy_load_data_global(raw, column_name):
+    # load_data_global before aggregating on the wide matrix, kept as the baseline.
+    agg_dict = {column_name: sum, 'Lat': np.median, 'Long': np.median}
+    data = raw \
+        .rename(columns={'Country/Region': 'Country'}) \
+        .melt(id_vars=['Country', 'Province/State', 'Lat', 'Long'], var_name='date', value_name=column_name) \
+        .astype({'date': 'datetime64[ns]', column_name: 'Int64'}, errors='ignore')
+    data_china = data[data.Country == 'China']
+    data = data.groupby(['Country', 'date']).agg(agg_dict).reset_index()
+    data['Province/State'] = '<all>'
+    return pd.concat([data, data_china])
+
+
+def legacy_load_data_us(raw, column_name):
+    # load_data_us before aggregating on the wide matrix, kept as the baseline.
+    id_vars = ['Country', 'Province/State', 'Lat', 'Long']
+    agg_dict = {column_name: sum, 'Lat': np.median, 'Long': np.median}
+    data = raw.iloc[:, 6:]
+    if 'Population' in data.columns:
+        data = data.drop('Population', axis=1)
+    data = data \
+        .drop('Combined_Key', axis=1) \
+        .rename(columns={'Country_Region': 'Country', 'Province_State': 'Province/State', 'Long_': 'Long'}) \
+        .melt(id_vars=id_vars, var_name='date', value_name=column_name) \
+        .astype({'date': 'datetime64[ns]', column_name: 'Int64'}, errors='ignore') \
+        .groupby(['Country', 'Province/State', 'date']).agg(agg_dict).reset_index()
+    return data
+
+
+def write_fixtures(directory, pickle_file=bundledPickle):
+    # CSSE-format copies of the bundled dataset: global files per country (China per province),
+    # US files with every state split into two counties.
+    data = pd.read_pickle(pickle_file)
+    data = data.assign(label=[d.strftime('%m/%d/%y').lstrip('0').replace('/0', '/') for d in data['date']])
+    labels = list(dict.fromkeys(data.sort_values('date')['label']))
+    is_total = data['Province/State'] == '<all>'
+    is_global = (data['Country'] == 'China') != is_total
+    os.makedirs(directory, exist_ok=True)
+    for name, column in [('confirmed', 'CumConfirmed'), ('deaths', 'CumDeaths')]:
+        wide = data[is_global].pivot_table(index=['Province/State', 'Country', 'Lat', 'Long'], columns='label',
+                                           values=column, aggfunc='sum')[labels].reset_index()
+        wide['Province/State'] = wide['Province/State'].replace('<all>', '')
+        wide.rename(columns={'Country': 'Country/Region'}).to_csv(
+            os.path.join(directory, 'time_series_covid19_{}_global.csv'.format(name)), index=False)
+        states = data[(data['Country'] == 'US') & ~is_total].pivot_table(
+            index=['Province/State', 'Lat', 'Long'], columns='label', values=column,
+            aggfunc='sum')[labels].reset_index()
+        half = states[labels] // 2
+        counties = pd.concat([states.assign(Admin2='North'), states.assign(Admin2='South')], ignore_index=True)
+        counties[labels] = pd.concat([half, states[labels] - half], ignore_index=True)
+        ids = pd.DataFrame({
+            'UID': 84000000 + counties.index, 'iso2': 'US', 'iso3': 'USA', 'code3': 840, 'FIPS': counties.index * 1.0,
+            'Admin2': counties['Admin2'], 'Province_State': counties['Province/State'], 'Country_Region': 'US',
+            'Lat': counties['Lat'], 'Long_': counties['Long'],
+            'Combined_Key': counties['Admin2'] + ', ' + counties['Province/State'] + ', US'})
+        if name == 'deaths':
+            ids['Population'] = 100000
+        pd.concat([ids, counties[labels].astype('int64')], axis=1).to_csv(
+            os.path.join(directory, 'time_series_covid19_{}_US.csv'.format(name)), index=False)
+    return directory
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+
+def repeated(function, *args, repeat=5):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - started)
+    return result, {'min': min(times), 'median': statistics.median(times), 'repeat': repeat}
+
+
+def peak_memory(function, *args):
+    # Run separately from timed(), tracing allocations slows the function down.
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def figure_payloads(regions=defaultRegions):
+    snapshot = main.current_snapshot()
+    results = []
+    for country, state in regions:
+        data = main.filtered_data(country, state, snapshot)
+        for prefix in ['New', 'Cum']:
+            sizes = {mode: len(to_json_plotly(main.barchart(data, main.metricNames, prefix=prefix, lean=lean)))
+                     for mode, lean in [('legacy', False), ('lean', True)]}
+            results.append({'country': country, 'state': state, 'figure': prefix, 'rows': len(data), **sizes})
+    return results
+
+
+def loader_timings(countries=190, provinces=33, states=58, counties=3300, days=500, legacy=True):
+    # The melt-first loaders take minutes at ten times the counties; legacy=False times the current ones only.
+    raw_global = global_frames(countries, provinces, days)[0]
+    raw_us = us_frames(states, counties, days)[0]
+    results = []
+    for name, raw, legacy_loader, current in [
+            ('load_data_global', raw_global, legacy_load_data_global, loaders.load_data_global),
+            ('load_data_us', raw_us, legacy_load_data_us, loaders.load_data_us)]:
+        result = {'loader': name, 'rows': len(raw), 'days': days, 'current': timed(current, raw, 'CumConfirmed'),
+                  'current_peak': peak_memory(current, raw, 'CumConfirmed')}
+        if legacy:
+            result.update(legacy=timed(legacy_loader, raw, 'CumConfirmed'),
+                          legacy_peak=peak_memory(legacy_loader, raw, 'CumConfirmed'))
+        results.append(result)
+    return results
+
+
+def stage_timings(fixtures, regions=defaultRegions, repeat=5):
+    results = []
+
+    def measure(stage, subject, function, *args):
+        result, seconds = repeated(function, *args, repeat=repeat)
+        results.append({'stage': stage, 'subject': subject, **seconds})
+        return result
+
+    loaded = []
+    for loader, file_name, column_name in main.sourceFiles:
+        with open(os.path.join(fixtures, file_name), 'rb') as source:
+            body = source.read()
+        raw = measure('parse', file_name, lambda: pd.read_csv(io.BytesIO(body)))
+        if loader is loaders.load_data_us:
+            raw = raw.rename(columns={'Country_Region': 'Country', 'Province_State': 'Province/State', 'Long_': 'Long'})
+            by = ['Country', 'Province/State']
+        else:
+            raw = raw.rename(columns={'Country/Region': 'Country'})
+            by = ['Country']
+        ids, values, dates = measure('split', file_name, loaders.split_dates, raw)
+        regions_ids, region_values = measure('aggregate', file_name, loaders.aggregate_wide, ids, values, by)
+        measure('reshape', file_name, loaders.wide_to_long, regions_ids, region_values, dates, column_name)
+        loaded.append(measure('load', file_name, loaders.parse_csv, loader, body, column_name)[1])
+    data = measure('merge', 'all', main.merge_sources, *loaded)
+    derived = measure('derive', 'all', main.derive_metrics, data)
+    measure('index', 'all', main.build_index, derived)
+    etag = main.dataset_etag(derived)
+    measure('etag', 'all', main.dataset_etag, derived)
+    with tempfile.TemporaryDirectory() as directory:
+        # A version directory is written once, so every repetition gets its own store.
+        measure('store_write', 'all', lambda: main.write_store(derived, etag, tempfile.mkdtemp(dir=directory)))
+        main.write_store(derived, etag, directory)
+        measure('store_read', 'all', main.read_store, directory)
+        pickle_file = os.path.join(directory, 'allData.pkl')
+        measure('pickle_round_trip', 'all', lambda: (derived.to_pickle(pickle_file), pd.read_pickle(pickle_file)))
+    snapshot = main.publish_data(derived, derived=True, etag=etag)
+    for country, state in regions:
+        subject = country + '/' + state
+        region = measure('filtered_data', subject, main.filtered_data, country, state, snapshot)
+        for name, (prefix, yaxis_title) in main.figureKinds.items():
+            figure = measure('barchart', subject + '/' + name, main.barchart, region, main.metricNames, prefix,
+                             yaxis_title)
+            measure('serialize', subject + '/' + name, to_json_plotly, figure)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(baseline, current):
+    # Median seconds of current vs baseline per stage and subject, slowest regressions first.
+    before = {(r['stage'], r['subject']): r['median'] for r in baseline['results']}
+    rows = [(r['median'] / before[r['stage'], r['subject']], r) for r in current['results']
+            if before.get((r['stage'], r['subject']))]
+    return sorted(rows, key=lambda row: -row[0])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of the dashboard's data and figure paths.")
+    parser.add_argument('--output', help="Write the results to this JSON file.")
+    parser.add_argument('--fixtures', help="Directory with the four CSSE files the dataset is loaded from, "
+                                           "by default written from the bundled dataset to a temporary directory.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    suite = commands.add_parser('suite', help="Seconds per stage of the refresh and request paths on fixture files.")
+    suite.add_argument('--repeat', type=int, default=5)
+    comparison = commands.add_parser('compare', help="Compare two result files written by 'suite --output'.")
+    comparison.add_argument('baseline')
+    comparison.add_argument('current')
+    commands.add_parser('payload', help="Bytes per serialized figure, legacy vs lean encoding.")
+    loader_parser = commands.add_parser('loaders', help="Loader seconds on generated CSSE data, legacy vs current.")
+    loader_parser.add_argument('--countries', type=int, default=190)
+    loader_parser.add_argument('--provinces', type=int, default=33)
+    loader_parser.add_argument('--states', type=int, default=58)
+    loader_parser.add_argument('--counties', type=int, default=3300)
+    loader_parser.add_argument('--days', type=int, default=500)
+    loader_parser.add_argument('--skip-legacy', action='store_true', help="Time the current loaders only.")
+    args = parser.parse_args()
+    if args.command != 'compare':
+        fixtures = args.fixtures or write_fixtures(tempfile.mkdtemp(prefix='fixtures-'))
+        # main loads its dataset at import; with the fixtures as source that never needs the network.
+        os.environ.setdefault('COVID_SOURCE', fixtures)
+        import main
+    if args.command == 'suite':
+        results = {'commit': git_commit(), 'created': datetime.now(timezone.utc).isoformat(),
+                   'python': platform.python_version(), 'pandas': pd.__version__, 'fixtures': fixtures,
+                   'results': stage_timings(fixtures, repeat=args.repeat)}
+        for result in results['results']:
+            print("{stage:<18} {subject:<45} {min:9.4f}s min {median:9.4f}s median".format(**result))
+    elif args.command == 'compare':
+        with open(args.baseline) as baseline, open(args.current) as current:
+            results = [{'ratio': ratio, **result} for ratio, result in compare(json.load(baseline), json.load(current))]
+        for result in results:
+            print("{stage:<18} {subject:<45} {median:9.4f}s {ratio:6.2f}x".format(**result))
+    elif args.command == 'payload':
+        results = figure_payloads()
+        for result in results:
+            print("{country:>8} {state:<12} {figure} {rows:>5} rows: {legacy:>7} -> {lean:>6} bytes".format(**result))
+    else:
+        results = loader_timings(args.countries, args.provinces, args.states, args.counties, args.days,
+                                 not args.skip_legacy)
+        for result in results:
+            if args.skip_legacy:
+                print("{loader:<17} {rows:>5} rows x {days} days: {current:6.2f}s, "
+                      "peak {current_peak:>11,} bytes".format(**result))
+            else:
+                print("{loader:<17} {rows:>5} rows x {days} days: {legacy:8.2f}s -> {current:6.2f}s, "
+                      "peak {legacy_peak:>11,} -> {current_peak:>11,} bytes".format(**result))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
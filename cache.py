@@ -0,0 +1,103 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from glob import glob
+
+
+class FigureCache:
+    # LRU cache with optional expiry and an optional on-disk tier that survives restarts.
+
+    def __init__(self, max_size=256, ttl=0, directory=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = self.evictions = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def disk_path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + '.pkl')
+
+    def expired(self, stored):
+        return self.ttl > 0 and time.time() - stored > self.ttl
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and not self.expired(entry[0]):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+        value = self.load(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.store(key, value)
+        return value
+
+    def load(self, key):
+        if not self.directory:
+            return None
+        path = self.disk_path(key)
+        try:
+            if self.expired(os.path.getmtime(path)):
+                return None
+            with open(path, 'rb') as file:
+                return pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def store(self, key, value):
+        self.entries[key] = (time.time(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, key, value):
+        with self.lock:
+            self.store(key, value)
+        if self.directory:
+            handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(handle, 'wb') as file:
+                pickle.dump(value, file)
+            os.replace(temporary, self.disk_path(key))
+
+    def clear(self):
+        # Memory tier only: disk entries are keyed by dataset version too, may belong to other processes sharing the
+        # directory and are removed by prune().
+        with self.lock:
+            self.entries.clear()
+
+    def prune(self, max_age):
+        # Removes disk entries written more than max_age seconds ago. Other processes may prune at the same time.
+        if not self.directory:
+            return 0
+        removed = 0
+        cutoff = time.time() - max_age
+        for path in glob(os.path.join(self.directory, '*.pkl')):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def reset_stats(self):
+        self.hits = self.disk_hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits, 'disk_hits': self.disk_hits,
+                    'misses': self.misses, 'evictions': self.evictions}
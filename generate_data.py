@@ -0,0 +1,84 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+globalIdColumns = ['Province/State', 'Country/Region', 'Lat', 'Long']
+usIdColumns = ['UID', 'iso2', 'iso3', 'code3', 'FIPS', 'Admin2', 'Province_State', 'Country_Region', 'Lat', 'Long_',
+               'Combined_Key']
+
+
+def date_columns(days, start='2020-01-22'):
+    # Same labels as the CSSE files: month/day/two-digit year without leading zeros.
+    return ['{}/{}/{}'.format(d.month, d.day, d.year % 100) for d in pd.date_range(start, periods=days)]
+
+
+def cumulated_cases(rng, rows, days, fatality=0.02):
+    # Every row gets its own daily rate, so regions differ in size like the real data.
+    rates = rng.gamma(0.5, 20, (rows, 1))
+    new = rng.poisson(rates, (rows, days))
+    return new.cumsum(axis=1), rng.binomial(new, fatality).cumsum(axis=1)
+
+
+def global_frames(countries=190, provinces=33, days=500, seed=0, start='2020-01-22'):
+    # The first country is split into provinces like China, every other country has a single row.
+    rng = np.random.default_rng(seed)
+    rows = provinces + countries - 1
+    ids = pd.DataFrame({
+        'Province/State': ['Province {}'.format(i) for i in range(provinces)] + [None] * (countries - 1),
+        'Country/Region': ['China'] * provinces + ['Country {}'.format(i) for i in range(1, countries)],
+        'Lat': rng.uniform(-60, 70, rows).round(4), 'Long': rng.uniform(-180, 180, rows).round(4)},
+        columns=globalIdColumns)
+    labels = date_columns(days, start)
+    confirmed, deaths = cumulated_cases(rng, rows, days)
+    return (pd.concat([ids, pd.DataFrame(confirmed, columns=labels)], axis=1),
+            pd.concat([ids, pd.DataFrame(deaths, columns=labels)], axis=1))
+
+
+def us_frames(states=58, counties=3300, days=500, seed=0, start='2020-01-22'):
+    # Counties are dealt round-robin to the states; the deaths file has Population before the dates.
+    rng = np.random.default_rng(seed)
+    state = ['State {}'.format(i % states) for i in range(counties)]
+    county = ['County {}'.format(i) for i in range(counties)]
+    ids = pd.DataFrame({
+        'UID': 84000000 + np.arange(counties), 'iso2': 'US', 'iso3': 'USA', 'code3': 840,
+        'FIPS': np.arange(1001, 1001 + counties, dtype=float), 'Admin2': county, 'Province_State': state,
+        'Country_Region': 'US', 'Lat': rng.uniform(20, 60, counties).round(4),
+        'Long_': rng.uniform(-160, -70, counties).round(4),
+        'Combined_Key': [c + ', ' + s + ', US' for c, s in zip(county, state)]}, columns=usIdColumns)
+    labels = date_columns(days, start)
+    confirmed, deaths = cumulated_cases(rng, counties, days)
+    population = pd.DataFrame({'Population': rng.integers(1000, 1000000, counties)})
+    return (pd.concat([ids, pd.DataFrame(confirmed, columns=labels)], axis=1),
+            pd.concat([ids, population, pd.DataFrame(deaths, columns=labels)], axis=1))
+
+
+def write_dataset(directory, countries=190, provinces=33, states=58, counties=3300, days=500, seed=0,
+                  start='2020-01-22'):
+    os.makedirs(directory, exist_ok=True)
+    frames = {'global': global_frames(countries, provinces, days, seed, start),
+              'US': us_frames(states, counties, days, seed, start)}
+    paths = []
+    for scope, (confirmed, deaths) in frames.items():
+        for name, frame in [('confirmed', confirmed), ('deaths', deaths)]:
+            path = os.path.join(directory, 'time_series_covid19_{}_{}.csv'.format(name, scope))
+            frame.to_csv(path, index=False)
+            paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write synthetic time series in the layout of the CSSE files.")
+    parser.add_argument('directory', help="Target directory for the four time_series_covid19_*.csv files.")
+    parser.add_argument('--countries', type=int, default=190)
+    parser.add_argument('--provinces', type=int, default=33, help="Provinces of the first country.")
+    parser.add_argument('--states', type=int, default=58)
+    parser.add_argument('--counties', type=int, default=3300)
+    parser.add_argument('--days', type=int, default=500)
+    parser.add_argument('--start', default='2020-01-22', help="Date of the first column.")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for path in write_dataset(args.directory, args.countries, args.provinces, args.states, args.counties, args.days,
+                              args.seed, args.start):
+        print(path)
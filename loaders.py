@@ -0,0 +1,72 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+# Parsing of the CSSE files, kept apart from main so parse pool workers can import it without the app and the
+# dataset, and so pickling these functions never waits for the import of main to finish.
+
+
+def column_dates(columns):
+    # NaT for the identifier columns.
+    return pd.to_datetime(pd.Index(columns), format='%m/%d/%y', errors='coerce')
+
+
+def split_dates(raw):
+    # Identifier columns, the counts as a 2-D array with one column per date, and the dates.
+    dates = column_dates(raw.columns)
+    is_date = np.asarray(pd.notna(dates))
+    return raw.loc[:, ~is_date], raw.loc[:, is_date].to_numpy(), dates[is_date]
+
+
+def aggregate_wide(ids, values, by):
+    # Sums whole rows of the wide matrix per group, so the row count only grows by the number of dates afterwards.
+    keys = [ids[column] for column in by]
+    sums = pd.DataFrame(values, index=ids.index).groupby(keys).sum()
+    coordinates = ids[['Lat', 'Long']].groupby(keys).median()
+    return coordinates.reset_index(), sums.to_numpy()
+
+
+def wide_to_long(ids, values, dates, column_name):
+    data = ids.loc[ids.index.repeat(len(dates))].reset_index(drop=True)
+    data['date'] = np.tile(dates.to_numpy().astype('datetime64[ns]'), len(ids))
+    data[column_name] = pd.array(values.ravel(), dtype='Int64')
+    return data
+
+
+def load_data_global(raw, column_name):
+    ids, values, dates = split_dates(raw.rename(columns={'Country/Region': 'Country'}))
+    totals, total_values = aggregate_wide(ids, values, ['Country'])
+    totals['Province/State'] = '<all>'
+    # Extract chinese provinces separately.
+    china = np.asarray(ids['Country'] == 'China')
+    provinces = ids.loc[china, ['Country', 'Province/State', 'Lat', 'Long']].reset_index(drop=True)
+    return pd.concat([wide_to_long(totals, total_values, dates, column_name),
+                      wide_to_long(provinces, values[china], dates, column_name)], ignore_index=True)
+
+
+def load_data_us(raw, column_name):
+    ids, values, dates = split_dates(
+        raw.rename(columns={'Country_Region': 'Country', 'Province_State': 'Province/State', 'Long_': 'Long'}))
+    regions, region_values = aggregate_wide(ids, values, ['Country', 'Province/State'])
+    return wide_to_long(regions, region_values, dates, column_name)
+
+
+def new_date_columns(previous, raw):
+    # None when rows or already known values changed, which requires a full rebuild.
+    known = list(previous.columns)
+    if list(raw.columns[:len(known)]) != known or not raw[known].equals(previous):
+        return None
+    return list(raw.columns[len(known):])
+
+
+def parse_csv(loader, body, column_name, previous=None):
+    raw = pd.read_csv(io.BytesIO(body))
+    if previous is not None:
+        added = new_date_columns(previous['raw'], raw)
+        if added == []:
+            return raw, previous['data'], 'unchanged'
+        if added:
+            id_columns = [column for column, date in zip(raw.columns, column_dates(raw.columns)) if pd.isna(date)]
+            return raw, pd.concat([previous['data'], loader(raw[id_columns + added], column_name)]), 'incremental'
+    return raw, loader(raw, column_name), 'full'
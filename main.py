@@ -1,72 +1,550 @@
 import dash
-import dash_core_components as dcc
-import dash_html_components as html
 import plotly.graph_objects as go
-from dash.dependencies import Input, Output
+from dash import Input, Output, Patch, State, dcc, html
+from flask import Response, abort, g, request, send_from_directory, url_for
+import functools
+import logging
+import os
+import threading
+import time
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import shutil
+import tempfile
+from collections import Counter, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from os.path import isfile
-
-baseURL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/"
-fileNamePickle = "allData.pkl"
+from itertools import count
+from glob import glob
+from os.path import isdir, isfile
+from cache import FigureCache
+from loaders import load_data_global, load_data_us, parse_csv
+from metrics import Gauge, Histogram, Registry
+from profiling import Profiler
+from sources import open_source, upstreamURL
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, every process refreshes on its own.
+    fcntl = None
+
+# URL, local mirror directory, file:// URL or tarball the CSSE files are read from (COVID_BASE_URL is the old name).
+dataSource = os.environ.get('COVID_SOURCE', os.environ.get('COVID_BASE_URL', upstreamURL))
+fileNamePickle = "allData.pkl"  # Legacy store, only read once to migrate to dataStore.
+dataStore = os.environ.get('DATA_STORE', "allData.arrow")  # One directory per version holding one Arrow IPC file.
+storeFile = "data.arrow"
+refreshInterval = int(os.environ.get('REFRESH_INTERVAL', 3600))  # Seconds between background refreshes, 0 disables.
+fetchTimeout = float(os.environ.get('FETCH_TIMEOUT', 60))
+refreshWorkers = int(os.environ.get('REFRESH_WORKERS', 4))  # Source files downloaded concurrently.
+parseProcesses = int(os.environ.get('PARSE_PROCESSES', 0))  # Parse in a process pool of this size, 0 parses in threads.
+incrementalRefresh = os.environ.get('INCREMENTAL_REFRESH', '1') != '0'  # Only melt the date columns added since the last download.
+storePollInterval = int(os.environ.get('STORE_POLL_INTERVAL', 60))  # Seconds between store checks of reader processes.
+snapshotMaxAge = int(os.environ.get('SNAPSHOT_MAX_AGE', 7200))  # Seconds before serving kicks off a refresh, 0 never.
+revalidateInterval = int(os.environ.get('REVALIDATE_INTERVAL', 300))  # Minimum seconds between two of those refreshes.
+figureCacheSize = int(os.environ.get('FIGURE_CACHE_SIZE', 256))  # Regions kept in memory.
+figureCacheTTL = int(os.environ.get('FIGURE_CACHE_TTL', 0))  # Seconds before a cached figure expires, 0 never.
+figureCacheDir = os.environ.get('FIGURE_CACHE_DIR')  # Optional on-disk tier.
+figureCachePrune = int(os.environ.get('FIGURE_CACHE_PRUNE', 86400))  # Seconds after which a disk entry is removed.
+# Regions rendered into the figure cache after each new dataset, as 'Country:State' separated by ';'.
+prerenderRegions = [tuple(region.split(':', 1)) for region in os.environ.get(
+    'PRERENDER_REGIONS',
+    "US:<all>;US:California;US:New York;US:Texas;US:Florida;China:<all>;India:<all>;Brazil:<all>;"
+    "Russia:<all>;United Kingdom:<all>;Germany:<all>;France:<all>;Italy:<all>;Spain:<all>").split(';') if region]
+leanFigures = os.environ.get('LEAN_FIGURES', '1') != '0'  # Date axis from x0/dx and typed arrays instead of date strings.
+prerenderTop = int(os.environ.get('PRERENDER_TOP', 20))  # Most requested regions also rendered after each new dataset.
+profileDir = os.environ.get('PROFILE_DIR')  # Opt-in: cProfile callback requests into this directory.
+profileToken = os.environ.get('PROFILE_TOKEN')  # Then only requests sending it are profiled, and /profiles is served.
+metricsInterval = float(os.environ.get('METRICS_INTERVAL', 5))  # Seconds between metric dumps of a worker, 0 per process.
+metricsDir = os.environ.get('METRICS_DIR', os.path.normpath(dataStore) + '.metrics')  # Next to dataStore, not inside.
+
+# Where refreshes read the CSSE files from.
+source = open_source(dataSource, fetchTimeout)
+# Figures per (figure, country, state, dataset etag), emptied whenever a new dataset is published.
+figureCache = FigureCache(max_size=figureCacheSize, ttl=figureCacheTTL, directory=figureCacheDir)
+# Views per (country, state), used to pick the regions to prerender.
+regionRequests = Counter()
+# Set once the whole module has run, see start_prerender().
+moduleLoaded = False
+
+# Validators (ETag / Last-Modified), raw wide frame and parsed frame of the last successful download, per source file.
+sourceCache = {}
+# Fetch and parse seconds of the last refresh, per source file.
+refreshTimings = {}
+
+# Per-request profiles of callback requests, None unless PROFILE_DIR is set.
+profiler = Profiler(profileDir, profileToken) if profileDir else None
+
+# Served on /metrics in the Prometheus text format.
+# Every worker dumps its metrics to metricsDir, so a scrape of any of them covers all.
+metricsRegistry = Registry(metricsDir if metricsInterval > 0 else None, metricsInterval)
+callbackLatency = metricsRegistry.register(Histogram(
+    'covid_callback_duration_seconds', "Seconds spent in server-side Dash callbacks.", ['callback', 'outcome']))
+refreshDuration = metricsRegistry.register(Histogram(
+    'covid_refresh_duration_seconds', "Seconds per refresh from the data source.", ['result']))
+if metricsRegistry.directory and hasattr(os, 'register_at_fork'):
+    # Summed over workers, so a worker forked from a preloaded app only counts its own lookups.
+    os.register_at_fork(after_in_child=figureCache.reset_stats)
+
+logger = logging.getLogger(__name__)
+
+# Under `python main.py`, parse pool workers started with spawn or forkserver import this module again as __mp_main__.
+# They only run loaders.parse_csv, so they must neither load the dataset, nor wait for the store their parent is about
+# to write, nor refresh. Every other process importing main, multiprocessing server workers included, serves.
+poolImport = __name__ == '__mp_main__'
+
+# Immutable view of one dataset version. Callbacks read it but never modify it.
+Snapshot = namedtuple('Snapshot', ['version', 'etag', 'created', 'data', 'index'])
+
+# Row slices of a snapshot per (country, province), plus the state dropdown values per country.
+RegionIndex = namedtuple('RegionIndex', ['regions', 'states'])
+
+metricNames = ['Confirmed', 'Deaths']
+
+# Column prefix and y axis title of each figure.
+figureKinds = {'new': ('New', "New Cases per Day"), 'cum': ('Cum', "Cumulated Cases")}
+
+# Dtypes of the published dataset: regions and date labels repeat on every row, counts fit in 32 bits.
+compactDtypes = {'Country': 'category', 'Province/State': 'category', 'dateStr': 'category',
+                 'Lat': 'float32', 'Long': 'float32'}
+compactDtypes.update({prefix + m: 'int32' for prefix in ['Cum', 'New'] for m in metricNames})
+compactDtypes.update({'New' + m + 'SMA7': 'float32' for m in metricNames})
+
+# Snapshot served to the callbacks, replaced as a whole by publish_data().
+currentSnapshot = None
+snapshotVersions = count(1)
+snapshotLock = threading.RLock()
+# Refresh currently running in this process; concurrent callers wait for its result instead of starting another.
+refreshInFlight = None
+refreshFlightLock = threading.Lock()
+# Set while a refresh started from the serving path runs in the background.
+revalidating = threading.Event()
+# Monotonic time of the last one, so a failing source or a reader that cannot lower the age is not retried per request.
+lastRevalidation = float('-inf')
+revalidationLock = threading.Lock()
+# Open lock file while this process is the single writer of dataStore, and the process that opened it.
+writerLock = None
+writerPid = None
+# Process running the refresh thread, so forked workers (gunicorn --preload) start their own.
+refreshThreadPid = None
+refreshThreadLock = threading.Lock()
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
 tickFont = {'size': 12, 'color': "rgb(30,30,30)", 'family': "Courier New, monospace"}
 
 
-def load_data_global(file_name, column_name):
-    agg_dict = {column_name: sum, 'Lat': np.median, 'Long': np.median}
-    data = pd.read_csv(baseURL + file_name) \
-        .rename(columns={'Country/Region': 'Country'}) \
-        .melt(id_vars=['Country', 'Province/State', 'Lat', 'Long'], var_name='date', value_name=column_name) \
-        .astype({'date': 'datetime64[ns]', column_name: 'Int64'}, errors='ignore')
-    # Extract chinese provinces separately.
-    data_china = data[data.Country == 'China']
-    data = data.groupby(['Country', 'date']).agg(agg_dict).reset_index()
-    data['Province/State'] = '<all>'
-    return pd.concat([data, data_china])
-
-
-def load_data_us(file_name, column_name):
-    id_vars = ['Country', 'Province/State', 'Lat', 'Long']
-    agg_dict = {column_name: sum, 'Lat': np.median, 'Long': np.median}
-    data = data = pd.read_csv(baseURL + file_name).iloc[:, 6:]
-    if 'Population' in data.columns:
-        data = data.drop('Population', axis=1)
-    data = data \
-        .drop('Combined_Key', axis=1) \
-        .rename(columns={'Country_Region': 'Country', 'Province_State': 'Province/State', 'Long_': 'Long'}) \
-        .melt(id_vars=id_vars, var_name='date', value_name=column_name) \
-        .astype({'date': 'datetime64[ns]', column_name: 'Int64'}, errors='ignore') \
-        .groupby(['Country', 'Province/State', 'date']).agg(agg_dict).reset_index()
-    return data
-
-
 def simple_moving_average(df, length=7):
     return df.rolling(length).mean()
 
 
-def refresh_data():
-    data_global = load_data_global("time_series_covid19_confirmed_global.csv", "CumConfirmed") \
-        .merge(load_data_global("time_series_covid19_deaths_global.csv", "CumDeaths"))
-    data_us = load_data_us("time_series_covid19_confirmed_US.csv", "CumConfirmed") \
-        .merge(load_data_us("time_series_covid19_deaths_US.csv", "CumDeaths"))
-    data = pd.concat([data_global, data_us])
-    data.to_pickle(fileNamePickle)
-    return data
+def memory_report(before, after):
+    report = pd.DataFrame({'before': before.memory_usage(deep=True, index=False),
+                           'after': after.memory_usage(deep=True, index=False)})
+    report.loc['total'] = report.sum()
+    return report
+
+
+def compact_dtypes(data):
+    # Columns already stored compactly are left untouched, so memory-mapped columns are not copied.
+    changed = {column: dtype for column, dtype in compactDtypes.items()
+               if column in data.columns and data[column].dtype != dtype}
+    if not changed:
+        return data
+    counts = {column: 0 for column, dtype in changed.items() if dtype == 'int32'}
+    compacted = data.fillna(counts).astype(changed)
+    report = memory_report(data, compacted)
+    logger.info("Compacted dataset from %d to %d bytes.", report.loc['total', 'before'], report.loc['total', 'after'])
+    logger.debug("Bytes per column:\n%s", report)
+    return compacted
+
+
+def derive_metrics(data, sma_length=7):
+    # Country totals for the countries only reported per province (e.g. US states).
+    reported = set(data.loc[data['Province/State'] == '<all>', 'Country'])
+    totals = data.loc[~data['Country'].isin(reported)] \
+        .groupby(['Country', 'date'], as_index=False, observed=True) \
+        .agg({'Cum' + m: 'sum' for m in metricNames} | {'Lat': 'median', 'Long': 'median'})
+    totals['Province/State'] = '<all>'
+    data = pd.concat([data, totals]).sort_values(['Country', 'Province/State', 'date'], ignore_index=True)
+    regions = data.groupby(['Country', 'Province/State'], sort=False, observed=True)
+    # Rolling over the whole column is only wrong for the first rows of a region, which are blanked.
+    first_rows = regions.cumcount() < sma_length - 1
+    for metric in metricNames:
+        data['New' + metric] = regions['Cum' + metric].diff().fillna(0)
+        data['New' + metric + 'SMA7'] = simple_moving_average(data['New' + metric], length=sma_length).mask(first_rows)
+    data['dateStr'] = data['date'].dt.strftime('%b %d, %Y')
+    return compact_dtypes(data)
+
+
+def load_source(loader, file_name, column_name, parse_pool=None):
+    started = time.perf_counter()
+    cached = sourceCache.get(file_name)
+    body, validators = source.fetch(file_name, cached)
+    fetched = time.perf_counter()
+    if body is None:
+        refreshTimings[file_name] = {'fetch': fetched - started, 'parse': 0.0}
+        logger.info("%s not modified (%.2fs), reusing the parsed data.", file_name, fetched - started)
+        return cached['data'], False
+    previous = cached if incrementalRefresh and cached else None
+    if parse_pool is None:
+        raw, data, mode = parse_csv(loader, body, column_name, previous)
+    else:
+        raw, data, mode = parse_pool.submit(parse_csv, loader, body, column_name, previous).result()
+    parsed = time.perf_counter()
+    sourceCache[file_name] = dict(validators, raw=raw, data=data)
+    refreshTimings[file_name] = {'fetch': fetched - started, 'parse': parsed - fetched}
+    logger.info("%s fetched in %.2fs, parsed (%s) in %.2fs.", file_name, fetched - started, mode, parsed - fetched)
+    return data, mode != 'unchanged'
+
+
+# Loader, file name and value column of each CSSE time series.
+sourceFiles = [
+    (load_data_global, "time_series_covid19_confirmed_global.csv", "CumConfirmed"),
+    (load_data_global, "time_series_covid19_deaths_global.csv", "CumDeaths"),
+    (load_data_us, "time_series_covid19_confirmed_US.csv", "CumConfirmed"),
+    (load_data_us, "time_series_covid19_deaths_US.csv", "CumDeaths"),
+]
+
+
+def load_sources(workers=None, processes=None):
+    workers = workers or refreshWorkers
+    processes = parseProcesses if processes is None else processes
+    parse_pool = ProcessPoolExecutor(processes) if processes > 0 else None
+    try:
+        with ThreadPoolExecutor(workers, thread_name_prefix="load-source") as pool:
+            jobs = [pool.submit(load_source, loader, file_name, column_name, parse_pool)
+                    for loader, file_name, column_name in sourceFiles]
+            return [job.result() for job in jobs]
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown()
 
 
-def all_data():
-    if not isfile(fileNamePickle):
-        refresh_data()
-    full_data = pd.read_pickle(fileNamePickle)
-    return full_data
+def refresh_data():
+    global refreshInFlight
+    with refreshFlightLock:
+        flight = refreshInFlight
+        if flight is None:
+            flight = refreshInFlight = Future()
+            leader = True
+        else:
+            leader = False
+    if not leader:
+        return flight.result()
+    try:
+        seen_etag = store_version()
+        with refresh_lock():
+            # Another process refreshed while this one waited for the lock: use its result instead of downloading.
+            if store_version() != seen_etag:
+                reload_store()
+                data = currentSnapshot.data
+            else:
+                data = run_refresh()
+        flight.set_result(data)
+        return data
+    except BaseException as error:
+        flight.set_exception(error)
+        raise
+    finally:
+        with refreshFlightLock:
+            refreshInFlight = None
+
+
+@contextmanager
+def refresh_lock():
+    # Serializes downloads and store writes across processes; the lock is released when the file is closed.
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(dataStore, exist_ok=True)
+    with open(os.path.join(dataStore, 'refresh.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def merge_sources(global_confirmed, global_deaths, us_confirmed, us_deaths):
+    return compact_dtypes(pd.concat([global_confirmed.merge(global_deaths), us_confirmed.merge(us_deaths)]))
+
+
+def run_refresh():
+    started = time.perf_counter()
+    result = 'error'
+    try:
+        data, result = load_and_publish(started)
+        return data
+    finally:
+        refreshDuration.observe(time.perf_counter() - started, result)
+
+
+def load_and_publish(started):
+    results = load_sources()
+    logger.info("Loaded %d source files in %.2fs.", len(results), time.perf_counter() - started)
+    if currentSnapshot is not None and not any(changed for _, changed in results):
+        logger.info("No source file changed, keeping dataset version %d.", currentSnapshot.version)
+        # The modification time of CURRENT tells every process when the data was last confirmed up to date.
+        if store_version() is not None:
+            os.utime(os.path.join(dataStore, 'CURRENT'))
+        return currentSnapshot.data, 'unchanged'
+    data = merge_sources(*[frame for frame, _ in results])
+    snapshot = publish_data(data)
+    write_store(snapshot.data, snapshot.etag)
+    return data, 'changed'
+
+
+def store_version(directory=dataStore):
+    try:
+        with open(os.path.join(directory, 'CURRENT')) as current:
+            etag = current.read().strip()
+    except FileNotFoundError:
+        return None
+    # Versions written one file per country are rewritten by the writer instead of being read.
+    return etag if etag and isfile(os.path.join(directory, etag, storeFile)) else None
+
+
+def arrow_table(data):
+    # One chunk per column, and NaN kept as a float value rather than a null, so read_store() needs no copy.
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_floating(field.type):
+            table = table.set_column(i, field, pa.array(data[field.name].to_numpy()))
+    return table.combine_chunks()
+
+
+def write_store(data, etag, directory=dataStore):
+    target = os.path.join(directory, etag)
+    if not isfile(os.path.join(target, storeFile)):
+        # Files of a version are never rewritten: readers keep the old ones memory-mapped until they reload.
+        staging = tempfile.mkdtemp(dir=directory, prefix=etag + '.')
+        table = arrow_table(data)
+        with pa.OSFile(os.path.join(staging, storeFile), 'wb') as file, pa.ipc.new_file(file, table.schema) as writer:
+            writer.write_table(table)
+        if isdir(target):
+            shutil.rmtree(target)  # Same version in the old layout with one file per country.
+        os.replace(staging, target)
+    replace_file(os.path.join(directory, 'CURRENT'), etag)
+    # Keep the previous version for readers that still have to map it. Only complete versions count: staging
+    # directories contain a dot, and anything else in the directory is none of write_store's business.
+    versions = [path for path in glob(os.path.join(directory, '*'))
+                if '.' not in os.path.basename(path) and isfile(os.path.join(path, storeFile))]
+    versions.sort(key=os.path.getmtime)
+    for path in versions[:-2]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def replace_file(path, text):
+    # Readers see the old or the new content, never a partly written file.
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.')
+    with os.fdopen(handle, 'w') as file:
+        file.write(text)
+    os.replace(temporary, path)
+
+
+def read_store(directory=dataStore):
+    etag = store_version(directory)
+    source = pa.memory_map(os.path.join(directory, etag, storeFile))
+    table = pa.ipc.open_file(source).read_all()
+    # A single chunk without nulls converts in place: those columns keep pointing into the mapped file, whose pages
+    # the OS shares between processes. Concatenating several files would copy every column.
+    dictionaries = [field.name for field in table.schema if pa.types.is_dictionary(field.type)]
+    columns = dict(table.drop_columns(dictionaries).to_pandas(split_blocks=True).items())
+    for name in dictionaries:
+        # to_pandas() would copy the codes; from_codes() keeps the mapped indices and only copies the categories.
+        column = table.column(name)
+        # combine_chunks() would unify the dictionary and copy the indices even for a single chunk.
+        column = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+        columns[name] = pd.Categorical.from_codes(column.indices.to_numpy(zero_copy_only=True),
+                                                  dtype=pd.CategoricalDtype(column.dictionary.to_pandas()),
+                                                  validate=False)
+    # Assigning columns one by one would copy them, the constructor with copy=False does not.
+    data = pd.DataFrame({name: columns[name] for name in table.column_names}, copy=False)
+    source.seek(0)
+    mapped = mapped_columns(data, source.read_buffer())
+    copied = [column for column in data.columns if column not in mapped]
+    logger.info("Read dataset %s: %d of %d columns memory-mapped, copied: %s.", etag, len(mapped), len(data.columns),
+                ', '.join(copied) or 'none')
+    return etag, data
+
+
+def mapped_columns(data, mapping):
+    # Columns whose values live inside the mapped buffer instead of private memory (categoricals: their codes).
+    start, end = mapping.address, mapping.address + mapping.size
+    mapped = []
+    for column in data.columns:
+        values = data[column]
+        values = values.array.codes if isinstance(values.dtype, pd.CategoricalDtype) else values.to_numpy()
+        if values.nbytes and start <= values.__array_interface__['data'][0] < end:
+            mapped.append(column)
+    return mapped
+
+
+def acquire_writer_lock():
+    global writerLock, writerPid
+    if writerPid == os.getpid():
+        return True
+    if fcntl is not None:
+        os.makedirs(dataStore, exist_ok=True)
+        lock = open(os.path.join(dataStore, 'writer.lock'), 'w')
+        try:
+            # Held until the process exits, so a new writer takes over when the current one dies.
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+        writerLock = lock
+    writerPid = os.getpid()
+    logger.info("Process %d is now the dataset writer.", writerPid)
+    return True
+
+
+def reload_store():
+    etag = store_version()
+    if etag is not None and (currentSnapshot is None or currentSnapshot.etag != etag):
+        etag, data = read_store()
+        publish_data(data, derived=True, etag=etag)
+
+
+def dataset_etag(data):
+    return format(int(pd.util.hash_pandas_object(data, index=False).sum()), '016x')
+
+
+def build_index(data):
+    regions = {}
+    # data is sorted by region, so each group is a contiguous block and iloc returns a view instead of a copy.
+    for (country, province), rows in data.groupby(['Country', 'Province/State'], sort=False, observed=True) \
+            .indices.items():
+        regions.setdefault(country, {})[province] = data.iloc[rows[0]:rows[-1] + 1]
+    states = {country: sorted(provinces) for country, provinces in regions.items()}
+    return RegionIndex(regions=regions, states=states)
+
+
+def publish_data(data, derived=False, etag=None):
+    global currentSnapshot
+    data = compact_dtypes(data) if derived else derive_metrics(data)
+    index = build_index(data)
+    with snapshotLock:
+        snapshot = Snapshot(version=next(snapshotVersions), etag=etag or dataset_etag(data), created=time.time(),
+                            data=data, index=index)
+        # A single reference assignment, so callbacks see either the old or the new snapshot, never a mix.
+        currentSnapshot = snapshot
+    # Figures of older versions are never hit again; on disk they are left for prune() to remove.
+    figureCache.clear()
+    figureCache.prune(figureCachePrune)
+    logger.info("Published dataset version %d (etag %s, %d rows).", snapshot.version, snapshot.etag, len(data))
+    start_prerender(snapshot)
+    return snapshot
+
+
+def start_prerender(snapshot):
+    # Warms the figure cache for every published version, whichever path published it, without delaying the
+    # publisher. The figure functions are defined after the import-time load, which is warmed at the end of the module.
+    if moduleLoaded and (prerenderRegions or prerenderTop > 0):
+        threading.Thread(target=prerender_figures, args=(snapshot,), name="prerender", daemon=True).start()
+
+
+def current_snapshot():
+    snapshot = currentSnapshot
+    if snapshot is None:
+        with snapshotLock:
+            # Only the first caller loads; the others find the snapshot once the lock is released.
+            if currentSnapshot is None:
+                if store_version() is None and acquire_writer_lock():
+                    if isfile(fileNamePickle):
+                        logger.info("Migrating %s to %s.", fileNamePickle, dataStore)
+                        snapshot = publish_data(pd.read_pickle(fileNamePickle))
+                        with refresh_lock():
+                            write_store(snapshot.data, snapshot.etag)
+                        # The migrated data is only as recent as the pickle it came from.
+                        modified = os.path.getmtime(fileNamePickle)
+                        os.utime(os.path.join(dataStore, 'CURRENT'), (modified, modified))
+                    else:
+                        refresh_data()
+                if store_version() is None:
+                    logger.info("Waiting for the dataset writer to create %s.", dataStore)
+                while store_version() is None:
+                    time.sleep(1)
+                reload_store()
+            snapshot = currentSnapshot
+    if refreshThreadPid != os.getpid():
+        start_refresh_thread()
+    return snapshot
 
 
-countries = all_data()['Country'].unique()
-countries.sort()
+def all_data():
+    return current_snapshot().data
+
+
+def snapshot_age():
+    try:
+        checked = os.path.getmtime(os.path.join(dataStore, 'CURRENT'))
+    except OSError:
+        checked = current_snapshot().created
+    return time.time() - checked
+
+
+def serve_snapshot():
+    # Stale-while-revalidate: always answer from the current snapshot, refresh in the background when too old.
+    global lastRevalidation
+    snapshot = current_snapshot()
+    if 0 < snapshotMaxAge < snapshot_age() and not revalidating.is_set():
+        with revalidationLock:
+            if revalidating.is_set() or time.monotonic() - lastRevalidation < revalidateInterval:
+                return snapshot
+            revalidating.set()
+            lastRevalidation = time.monotonic()
+        threading.Thread(target=revalidate, name="revalidate-data", daemon=True).start()
+    return snapshot
+
+
+def revalidate():
+    try:
+        if acquire_writer_lock():
+            refresh_data()
+        else:
+            reload_store()
+    except Exception:
+        logger.exception("Revalidation failed, keeping the previous dataset.")
+    finally:
+        revalidating.clear()
+
+
+def format_age(seconds):
+    for unit, length in [('day', 86400), ('hour', 3600), ('minute', 60)]:
+        if seconds >= length:
+            amount = int(seconds // length)
+            return "{} {}{} ago".format(amount, unit, 's' if amount > 1 else '')
+    return "just now"
+
+
+def refresh_loop(interval):
+    # Only the process holding the writer lock downloads; the others pick up what it publishes to dataStore.
+    while True:
+        delay = min(interval, storePollInterval)
+        try:
+            if acquire_writer_lock():
+                refresh_data()
+                delay = interval
+            else:
+                reload_store()
+        except Exception:
+            logger.exception("Background refresh failed, keeping the previous dataset.")
+        time.sleep(delay)
+
+
+def start_refresh_thread(interval=refreshInterval):
+    global refreshThreadPid
+    with refreshThreadLock:
+        if refreshThreadPid == os.getpid():
+            return None
+        refreshThreadPid = os.getpid()
+    if interval <= 0 or poolImport:
+        return None
+    thread = threading.Thread(target=refresh_loop, args=(interval,), name="refresh-data", daemon=True)
+    thread.start()
+    return thread
+
+
+countries = [] if poolImport else sorted(current_snapshot().index.regions)
 
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 
@@ -101,6 +579,7 @@ app.layout = html.Div(
     style={'font-family': "Courier New, monospace"},
     children=[
         html.H1('Case History of the Coronavirus (COVID-19)'),
+        html.Div(id='dataset-age'),
         html.Div(className="row", children=[
             html.Div(className="four columns", children=[
                 html.H5('Country'),
@@ -120,11 +599,14 @@ app.layout = html.Div(
                 html.H5('Selected Metrics'),
                 dcc.Checklist(
                     id='metrics',
-                    options=[{'label': m, 'value': m} for m in ['Confirmed', 'Deaths']],
-                    value=['Confirmed', 'Deaths']
+                    options=[{'label': m, 'value': m} for m in metricNames],
+                    value=metricNames
                 )
             ])
         ]),
+        # Figures of the selected region with every metric; the metrics checklist only toggles trace visibility.
+        dcc.Store(id='figure_new'),
+        dcc.Store(id='figure_cum'),
         dcc.Graph(
             id="plot_new_metrics",
             config={'displayModeBar': False}
@@ -133,96 +615,297 @@ app.layout = html.Div(
             id="plot_cum_metrics",
             config={'displayModeBar': False}
         ),
+        # Etag of the dataset the figures were drawn from, the figures only redraw when it changes.
+        dcc.Store(id='dataset-version'),
         dcc.Interval(
             id='interval-component',
-            interval=3600 * 1000,  # Refresh data each hour.
+            interval=600 * 1000,  # Check for a new dataset every ten minutes.
             n_intervals=0
         )
     ]
 )
 
 
+def instrumented(name):
+    # Goes below @app.callback; wraps() keeps the signature Dash sees.
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = function(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                callbackLatency.observe(time.perf_counter() - started, name, outcome)
+        return wrapper
+    return decorator
+
+
 @app.callback(
     [Output('state', 'options'), Output('state', 'value')],
     [Input('country', 'value')]
 )
+@instrumented('update_states')
 def update_states(country):
-    d = all_data()
-    states = list(d.loc[d['Country'] == country]['Province/State'].unique())
-    states.insert(0, '<all>')
-    states.sort()
+    states = serve_snapshot().index.states.get(country, ['<all>'])
     state_options = [{'label': s, 'value': s} for s in states]
     state_value = state_options[0]['value']
     return state_options, state_value
 
 
-def filtered_data(country, state):
-    d = all_data()
-    data = d.loc[d['Country'] == country].drop('Country', axis=1)
-    if state == '<all>':
-        data = data.drop('Province/State', axis=1).groupby("date").sum().reset_index()
-    else:
-        data = data.loc[data['Province/State'] == state]
-    new_cases = data.select_dtypes(include='Int64').diff().fillna(0)
-    new_cases.columns = [column.replace('Cum', 'New') for column in new_cases.columns]
-    data = data.join(new_cases)
-    data['dateStr'] = data['date'].dt.strftime('%b %d, %Y')
-    data['NewDeathsSMA7'] = simple_moving_average(data.NewDeaths, length=7)
-    data['NewConfirmedSMA7'] = simple_moving_average(data.NewConfirmed, length=7)
-    return data
+def filtered_data(country, state, snapshot=None):
+    snapshot = snapshot or current_snapshot()
+    return snapshot.index.regions.get(country, {}).get(state, snapshot.data.iloc[0:0])
+
+
+def date_axis(data, lean):
+    # Daily series without gaps are sent as a start date and a step instead of one date per point.
+    dates = data.date.to_numpy()
+    if lean and len(dates) > 1 and (np.diff(dates) == np.timedelta64(1, 'D')).all():
+        return {'x0': pd.Timestamp(dates[0]).isoformat(), 'dx': 24 * 3600 * 1000}
+    return {'x': data.date}
+
+
+def series(data, column, lean):
+    return data[column].to_numpy() if lean else data[column]
 
 
-def add_trend_lines(figure, data, metrics, prefix):
+def add_trend_lines(figure, data, metrics, prefix, lean=False):
     if prefix == 'New':
         for metric in metrics:
             figure.add_trace(
                 go.Scatter(
-                    x=data.date, y=data[prefix + metric + 'SMA7'],
+                    **date_axis(data, lean), y=series(data, prefix + metric + 'SMA7', lean),
                     mode='lines', line=dict(
                         width=3, color='rgb(200,30,30)' if metric == 'Deaths' else 'rgb(100,140,240)'
                     ),
                     name='Rolling 7-Day Average of Deaths' if metric == 'Deaths' \
-                        else 'Rolling 7-Day Average of Confirmed'
+                        else 'Rolling 7-Day Average of Confirmed',
+                    meta=metric
                 )
             )
 
 
-def barchart(data, metrics, prefix="", yaxis_title=""):
+def barchart(data, metrics, prefix="", yaxis_title="", lean=None):
+    lean = leanFigures if lean is None else lean
     figure = go.Figure(data=[
         go.Bar(
-            name=metric, x=data.date, y=data[prefix + metric],
+            name=metric, **date_axis(data, lean), y=series(data, prefix + metric, lean),
             marker_line_color='rgb(0,0,0)', marker_line_width=1,
-            marker_color={'Deaths': 'rgb(200,30,30)', 'Confirmed': 'rgb(100,140,240)'}[metric]
+            marker_color={'Deaths': 'rgb(200,30,30)', 'Confirmed': 'rgb(100,140,240)'}[metric],
+            meta=metric
         ) for metric in metrics
     ])
-    add_trend_lines(figure, data, metrics, prefix)
+    add_trend_lines(figure, data, metrics, prefix, lean)
     figure.update_layout(
         barmode='group', legend=dict(x=.05, y=0.95, font={'size': 15}, bgcolor='rgba(240,240,240,0.5)'),
         plot_bgcolor='#FFFFFF', font=tickFont) \
-        .update_xaxes(
-        title="", tickangle=-90, type='category', showgrid=True, gridcolor='#DDDDDD',
-        tickfont=tickFont, ticktext=data.dateStr, tickvals=data.date) \
         .update_yaxes(
         title=yaxis_title, showgrid=True, gridcolor='#DDDDDD')
+    if lean:
+        # Plotly formats the dates itself, no labels are sent.
+        figure.update_xaxes(
+            title="", tickangle=-90, type='date', showgrid=True, gridcolor='#DDDDDD',
+            tickfont=tickFont, tickformat='%b %d, %Y', hoverformat='%b %d, %Y')
+    else:
+        figure.update_xaxes(
+            title="", tickangle=-90, type='category', showgrid=True, gridcolor='#DDDDDD',
+            tickfont=tickFont, ticktext=data.dateStr, tickvals=data.date)
     return figure
 
 
 @app.callback(
-    [Output('plot_new_metrics', 'figure'), Output('plot_cum_metrics', 'figure')],
-    [Input('country', 'value'), Input('state', 'value'), Input('metrics', 'value'),
-     Input('interval-component', 'n_intervals')]
+    [Output('dataset-version', 'data'), Output('dataset-age', 'children')],
+    [Input('interval-component', 'n_intervals')],
+    [State('dataset-version', 'data')]
+)
+@instrumented('update_dataset_version')
+def update_dataset_version(n, seen_etag):
+    etag = serve_snapshot().etag
+    age = "Data checked for updates " + format_age(snapshot_age())
+    return dash.no_update if etag == seen_etag else etag, age
+
+
+def figure_patch(figure):
+    # Every region has the same traces and layout, so only the trace data has to be replaced, plus the date labels of
+    # a category axis: a new dataset version adds dates.
+    patch = Patch()
+    figure_json = figure.to_plotly_json()
+    xaxis = figure_json['layout']['xaxis']
+    if xaxis.get('type') == 'category':
+        patch['layout']['xaxis']['ticktext'] = xaxis['ticktext']
+        patch['layout']['xaxis']['tickvals'] = xaxis['tickvals']
+    for i, trace in enumerate(figure_json['data']):
+        patch['data'][i]['y'] = trace['y']
+        if 'x0' in trace:
+            patch['data'][i]['x0'] = trace['x0']
+            patch['data'][i]['dx'] = trace['dx']
+            del patch['data'][i]['x']
+        else:
+            patch['data'][i]['x'] = trace['x']
+            del patch['data'][i]['x0']
+            del patch['data'][i]['dx']
+    return patch
+
+
+def update_figure(name, country, state, modified):
+    figure = region_figure(name, country, state, serve_snapshot())
+    # The store's modified_timestamp stays -1 until the browser holds a full figure.
+    if modified is None or modified < 0:
+        return figure
+    return figure_patch(figure)
+
+
+@app.callback(
+    Output('figure_new', 'data'),
+    [Input('country', 'value'), Input('state', 'value'), Input('dataset-version', 'data')],
+    [State('figure_new', 'modified_timestamp')]
 )
-def update_plots(country, state, metrics, n):
-    refresh_data()
-    data = filtered_data(country, state)
-    barchart_new = barchart(data, metrics, prefix="New", yaxis_title="New Cases per Day")
-    barchart_cum = barchart(data, metrics, prefix="Cum", yaxis_title="Cumulated Cases")
-    return barchart_new, barchart_cum
+@instrumented('update_new_figure')
+def update_new_figure(country, state, etag, modified):
+    # Counted once per view, the cumulated figure is always requested along with this one. Only existing regions,
+    # so clients cannot grow the counter without limit.
+    if state in current_snapshot().index.regions.get(country, {}):
+        regionRequests[country, state] += 1
+    return update_figure('new', country, state, modified)
+
+
+@app.callback(
+    Output('figure_cum', 'data'),
+    [Input('country', 'value'), Input('state', 'value'), Input('dataset-version', 'data')],
+    [State('figure_cum', 'modified_timestamp')]
+)
+@instrumented('update_cum_figure')
+def update_cum_figure(country, state, etag, modified):
+    return update_figure('cum', country, state, modified)
+
+
+# Runs in the browser: checking or unchecking a metric never reaches the server.
+showMetrics = """
+function(figure, metrics) {
+    if (!figure) {
+        return window.dash_clientside.no_update;
+    }
+    return Object.assign({}, figure, {data: figure.data.map(function(trace) {
+        return Object.assign({}, trace, {visible: (metrics || []).indexOf(trace.meta) >= 0});
+    })});
+}
+"""
+app.clientside_callback(
+    showMetrics,
+    Output('plot_new_metrics', 'figure'),
+    [Input('figure_new', 'data'), Input('metrics', 'value')]
+)
+app.clientside_callback(
+    showMetrics,
+    Output('plot_cum_metrics', 'figure'),
+    [Input('figure_cum', 'data'), Input('metrics', 'value')]
+)
+
+
+def region_figure(name, country, state, snapshot):
+    key = (name, country, state, snapshot.etag)
+    figure = figureCache.get(key)
+    if figure is None:
+        prefix, yaxis_title = figureKinds[name]
+        figure = barchart(filtered_data(country, state, snapshot), metricNames, prefix=prefix, yaxis_title=yaxis_title)
+        figureCache.put(key, figure)
+    return figure
+
+
+def prerender_figures(snapshot):
+    started = time.perf_counter()
+    # Callbacks add regions while this runs; most_common() iterates in Python, copying the counter is one C call.
+    regions = prerenderRegions + [region for region, _ in regionRequests.copy().most_common(prerenderTop)]
+    rendered = 0
+    for country, state in dict.fromkeys(regions):
+        if currentSnapshot is not snapshot:
+            logger.info("Dataset version %d superseded, stopped prerendering.", snapshot.version)
+            return
+        if state in snapshot.index.states.get(country, []):
+            for name in figureKinds:
+                region_figure(name, country, state, snapshot)
+            rendered += 1
+    logger.info("Prerendered %d regions in %.2fs.", rendered, time.perf_counter() - started)
 
 
 server = app.server
 
+metricsRegistry.register(Gauge(
+    'covid_figure_cache_requests_total', "Figure cache lookups by result.",
+    lambda: {(result,): figureCache.stats()[key] for result, key in
+             [('hit', 'hits'), ('disk_hit', 'disk_hits'), ('miss', 'misses')]},
+    ['result'], kind='counter'))
+metricsRegistry.register(Gauge(
+    'covid_figure_cache_evictions_total', "Figures evicted from the memory tier.",
+    lambda: figureCache.stats()['evictions'], kind='counter'))
+metricsRegistry.register(Gauge(
+    'covid_figure_cache_entries', "Figures in the memory tiers of all workers.", lambda: figureCache.stats()['size'],
+    aggregate='sum'))
+metricsRegistry.register(Gauge(
+    'covid_source_seconds', "Fetch and parse seconds per source file in the last refresh.",
+    lambda: {(file_name, stage): seconds for file_name, timings in list(refreshTimings.items())
+             for stage, seconds in timings.items()},
+    ['file', 'stage']))
+metricsRegistry.register(Gauge(
+    'covid_dataset_version', "Dataset version served by each worker, counted per process.",
+    lambda: currentSnapshot.version if currentSnapshot else None, aggregate='pid'))
+metricsRegistry.register(Gauge(
+    'covid_dataset_age_seconds', "Seconds since the data was last confirmed up to date, in the most outdated worker.",
+    snapshot_age))
+
+
+@server.before_request
+def start_metrics():
+    metricsRegistry.start()
+
+
+@server.route('/metrics')
+def metrics():
+    return Response(metricsRegistry.render(), mimetype='text/plain; version=0.0.4')
+
+
+if profiler is not None:
+    # The whole request is profiled, so the time Dash spends encoding the figure shows up next to the callback.
+    @server.before_request
+    def start_profile():
+        if request.path.endswith('/_dash-update-component'):
+            g.profile = profiler.start(request.headers)
+
+    @server.teardown_request
+    def finish_profile(error=None):
+        started = g.pop('profile', None)
+        if started is not None:
+            body = request.get_json(silent=True) or {}
+            label = ' '.join([body.get('output', '')] + [str(i.get('value')) for i in body.get('inputs', [])
+                                                          if isinstance(i, dict)])
+            seconds = profiler.finish(started, label)
+            logger.info("Profiled %s in %.3fs.", label, seconds)
+
+
+if profiler is not None and profiler.token:
+    # Admin pages, only with a token; without one the profiles are read from profileDir directly.
+    @server.route('/profiles')
+    def profiles():
+        if not profiler.authorized(request.headers, request.args):
+            abort(403)
+        return profiler.summary(lambda name: url_for('profile_file', name=name, token=request.args.get('token')))
+
+    @server.route('/profiles/<name>')
+    def profile_file(name):
+        if not profiler.authorized(request.headers, request.args):
+            abort(403)
+        return send_from_directory(profiler.directory, name, as_attachment=True)
+
+
+# The dataset loaded at import was published before the figure functions existed.
+moduleLoaded = True
+if currentSnapshot is not None:
+    start_prerender(currentSnapshot)
+
 if __name__ == '__main__':
-    app.run_server(host="0.0.0.0")
+    app.run(host="0.0.0.0")
 
 # http://127.0.0.1: with given port number
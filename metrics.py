@@ -0,0 +1,204 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+# Upper bounds in seconds, from a figure cache hit to a full refresh.
+defaultBuckets = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+
+def label_text(names, values):
+    if not names:
+        return ''
+    pairs = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for name, value in zip(names, values))
+    return '{' + ','.join(pairs) + '}'
+
+
+class Histogram:
+    # Prometheus histogram with one series per label values. observe() is a bisect and two additions under a
+    # lock, cheap enough for every callback.
+
+    def __init__(self, name, help_text, labels=(), buckets=defaultBuckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def state(self):
+        with self.lock:
+            return [[list(values), list(counts), total] for values, (counts, total) in self.series.items()]
+
+    def reset(self):
+        with self.lock:
+            self.series = {}
+
+    def render(self, states=None):
+        # states are the state() of every process to add up, by default only this one's.
+        merged = {}
+        for state in [self.state()] if states is None else states:
+            for values, counts, total in state:
+                series = merged.setdefault(tuple(values), [[0] * (len(self.buckets) + 1), 0.0])
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+        lines = ['# HELP {} {}'.format(self.name, self.help_text), '# TYPE {} histogram'.format(self.name)]
+        for values, (counts, total) in sorted(merged.items()):
+            cumulated = 0
+            for bound, amount in zip(self.buckets + ('+Inf',), counts):
+                cumulated += amount
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, label_text(self.labels + ('le',), values + (bound,)), cumulated))
+            lines.append('{}_sum{} {}'.format(self.name, label_text(self.labels, values), total))
+            lines.append('{}_count{} {}'.format(self.name, label_text(self.labels, values), cumulated))
+        return lines
+
+
+class Gauge:
+    # Value read when scraped: collect() returns the value, or {label values: value} for labelled gauges.
+    # kind='counter' exposes totals that are kept elsewhere, like the figure cache statistics.
+    # aggregate combines the values of several processes: 'sum', 'max' or 'min', counters are summed; 'pid' keeps
+    # one series per process with a pid label instead.
+
+    def __init__(self, name, help_text, collect, labels=(), kind='gauge', aggregate=None):
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+        self.labels = tuple(labels)
+        self.kind = kind
+        self.aggregate = aggregate or ('sum' if kind == 'counter' else 'max')
+        if self.aggregate == 'pid':
+            self.labels += ('pid',)
+
+    def state(self):
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        pid = [os.getpid()] if self.aggregate == 'pid' else []
+        return [[list(labels) + pid, value] for labels, value in values.items() if value is not None]
+
+    def render(self, states=None):
+        combine = {'sum': sum, 'max': max, 'min': min, 'pid': max}[self.aggregate]
+        merged = {}
+        for state in [self.state()] if states is None else states:
+            for labels, value in state:
+                merged.setdefault(tuple(labels), []).append(value)
+        lines = ['# HELP {} {}'.format(self.name, self.help_text), '# TYPE {} {}'.format(self.name, self.kind)]
+        lines.extend('{}{} {}'.format(self.name, label_text(self.labels, labels), combine(values))
+                     for labels, values in merged.items())
+        return lines
+
+
+class Registry:
+    # Without a directory, render() shows the numbers of the process that is scraped. With one, every started
+    # process dumps its numbers to <directory>/<pid>-<id>.json each interval seconds and render() adds up the
+    # files written in the last expire seconds (by default three intervals, at least a minute), like the
+    # multiprocess mode of the Prometheus client. Files of processes that exited are removed, so their counts drop
+    # out and the totals look like a counter reset.
+
+    def __init__(self, directory=None, interval=5, expire=None):
+        self.metrics = []
+        self.directory = directory
+        self.interval = interval
+        self.expire = expire or max(60, 3 * interval)
+        self.lock = threading.Lock()
+        self.pid = None
+        self.path = None
+        if directory:
+            atexit.register(self.remove)
+            if hasattr(os, 'register_at_fork'):
+                # A forked worker starts from zero instead of counting again what its parent observed.
+                os.register_at_fork(after_in_child=self.forked)
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def forked(self):
+        self.lock = threading.Lock()
+        self.pid = self.path = None
+        for metric in self.metrics:
+            if hasattr(metric, 'reset'):
+                metric.reset()
+
+    def start(self):
+        # Starts the dump thread of this process; cheap to call on every request.
+        if not self.directory or self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self.pid = os.getpid()
+            self.path = os.path.join(self.directory, '{}-{}.json'.format(self.pid, uuid.uuid4().hex[:8]))
+            threading.Thread(target=self.dump_loop, args=(self.pid,), daemon=True).start()
+
+    def state(self):
+        return {metric.name: metric.state() for metric in self.metrics}
+
+    def dump_loop(self, pid):
+        while self.pid == pid:
+            try:
+                os.makedirs(self.directory, exist_ok=True)  # Recreated if someone removed it.
+                self.dump()
+            except OSError:
+                pass
+            time.sleep(self.interval)
+
+    def dump(self):
+        handle, temporary = tempfile.mkstemp(dir=self.directory, prefix='.', suffix='.tmp')
+        with os.fdopen(handle, 'w') as file:
+            json.dump(self.state(), file, default=float)
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        if self.path and self.pid == os.getpid():
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def states(self):
+        # This process' numbers as they are now, the others' as last dumped.
+        states = [self.state()]
+        if not self.directory:
+            return states
+        self.start()
+        cutoff = time.time() - self.expire
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:  # Removed since; the dump threads recreate it.
+            entries = []
+        for entry in entries:
+            if entry.path == self.path:
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                elif entry.name.endswith('.json'):
+                    with open(entry.path) as file:
+                        states.append(json.load(file))
+            except (OSError, ValueError):  # Removed by another scrape, or the process is gone.
+                continue
+        return states
+
+    def render(self):
+        states = self.states()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render([state.get(metric.name, []) for state in states]))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,86 @@
+import cProfile
+import html
+import io
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+class Profiler:
+    # cProfile around single requests, dumped to directory as <time>-<label>.prof for snakeviz or pstats.
+    # Without a token every request is profiled; with one only requests carrying it in the X-Profile-Token header.
+    # main serves the /profiles pages only with a token, they reveal the inputs and code of every request.
+
+    header = 'X-Profile-Token'
+
+    def __init__(self, directory, token=None, keep=100):
+        self.directory = directory
+        self.token = token
+        self.recent = deque()
+        self.keep = keep
+        # Only one profiler can be active at a time, concurrent requests are served without one.
+        self.active = threading.Lock()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def authorized(self, headers, args=None):
+        return not self.token or self.token in (headers.get(self.header), (args or {}).get('token'))
+
+    def start(self, headers):
+        if not self.authorized(headers) or not self.active.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Profiled by something else, e.g. a debugger.
+            self.active.release()
+            return None
+        return profile, time.perf_counter()
+
+    def finish(self, started, label):
+        profile, began = started
+        profile.disable()
+        self.active.release()
+        seconds = time.perf_counter() - began
+        now = datetime.now()
+        name = '{}-{}.prof'.format(now.strftime('%Y%m%d-%H%M%S-%f'), ''.join(
+            c if c.isalnum() or c in '-_.' else '_' for c in label)[:80])
+        profile.dump_stats(os.path.join(self.directory, name))
+        with self.lock:
+            self.recent.append({'name': name, 'label': label, 'seconds': seconds, 'time': now})
+            expired = [self.recent.popleft() for _ in range(len(self.recent) - self.keep)]
+        for entry in expired:
+            try:
+                os.remove(os.path.join(self.directory, entry['name']))
+            except OSError:
+                pass
+        return seconds
+
+    def slowest(self, count=20):
+        with self.lock:
+            return sorted(self.recent, key=lambda entry: -entry['seconds'])[:count]
+
+    def top_functions(self, name, count=15):
+        output = io.StringIO()
+        try:
+            pstats.Stats(os.path.join(self.directory, name), stream=output).sort_stats('cumulative').print_stats(count)
+        except OSError:
+            return "Profile no longer available."
+        # Skip the header lines up to the table.
+        text = output.getvalue()
+        return text[text.find('   ncalls'):] if '   ncalls' in text else text
+
+    def summary(self, link, count=20):
+        # link(name) is the URL a profile file is downloaded from.
+        rows = []
+        for entry in self.slowest(count):
+            rows.append('<h3>{:.1f} ms &ndash; {} &ndash; {} &ndash; <a href="{}">{}</a></h3><pre>{}</pre>'.format(
+                entry['seconds'] * 1000, html.escape(entry['label']), entry['time'].strftime('%Y-%m-%d %H:%M:%S'),
+                html.escape(link(entry['name'])), html.escape(entry['name']),
+                html.escape(self.top_functions(entry['name']))))
+        return ('<!DOCTYPE html><html><head><title>Slowest requests</title></head><body>'
+                '<h1>Slowest of the last {} profiled requests</h1>{}</body></html>').format(
+            len(self.recent), ''.join(rows) or '<p>No profiled requests yet.</p>')
@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import tarfile
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from email.utils import formatdate, parsedate_to_datetime
+
+upstreamURL = \
+    "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/"
+
+# The CSSE time series read by the dashboard, same names as in main.sourceFiles.
+upstreamFiles = [
+    "time_series_covid19_confirmed_global.csv",
+    "time_series_covid19_deaths_global.csv",
+    "time_series_covid19_confirmed_US.csv",
+    "time_series_covid19_deaths_US.csv",
+]
+
+# Validators of the mirrored files, kept next to them by sync().
+manifestName = '.sync.json'
+
+
+# Every source returns (body, validators) from fetch(), or (None, cached) when the file is unchanged since the
+# download described by cached. Validators are a dict with 'etag' and 'modified' (an HTTP date), either may be None.
+
+class HttpSource:
+    # Conditional GET below a base URL, so an unchanged file costs a 304 instead of a download.
+
+    def __init__(self, base_url, timeout=60):
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.timeout = timeout
+
+    def fetch(self, file_name, cached=None):
+        request = urllib.request.Request(self.base_url + file_name)
+        if cached and cached.get('etag'):
+            request.add_header('If-None-Match', cached['etag'])
+        if cached and cached.get('modified'):
+            request.add_header('If-Modified-Since', cached['modified'])
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                validators = {'etag': response.headers.get('ETag'), 'modified': response.headers.get('Last-Modified')}
+        except urllib.error.HTTPError as error:
+            if error.code == 304 and cached:
+                return None, cached
+            raise
+        return body, validators
+
+    def __repr__(self):
+        return 'HttpSource({!r})'.format(self.base_url)
+
+
+class DirectorySource:
+    # Files of a local mirror; size and modification time stand in for the ETag.
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, file_name, cached=None):
+        path = os.path.join(self.directory, file_name)
+        stat = os.stat(path)
+        validators = {'etag': '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size),
+                      'modified': formatdate(stat.st_mtime, usegmt=True)}
+        if cached and cached.get('etag') == validators['etag']:
+            return None, cached
+        with open(path, 'rb') as file:
+            return file.read(), validators
+
+    def __repr__(self):
+        return 'DirectorySource({!r})'.format(self.directory)
+
+
+class TarballSource:
+    # Snapshot archive of the upstream repository (or of a mirror); members are matched by file name, so the
+    # directory layout inside the archive does not matter.
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.members = {}
+        self.indexed = None
+
+    def member_names(self, archive, mtime):
+        with self.lock:
+            if self.indexed != mtime:
+                self.members = {os.path.basename(member.name): member.name
+                                for member in archive.getmembers() if member.isfile()}
+                self.indexed = mtime
+            return self.members
+
+    def fetch(self, file_name, cached=None):
+        stat = os.stat(self.path)
+        etag = '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+        if cached and cached.get('etag') == etag:
+            return None, cached
+        with tarfile.open(self.path) as archive:
+            name = self.member_names(archive, stat.st_mtime_ns).get(file_name)
+            if name is None:
+                raise FileNotFoundError("{} not in {}".format(file_name, self.path))
+            member = archive.getmember(name)
+            body = archive.extractfile(member).read()
+        return body, {'etag': etag, 'modified': formatdate(member.mtime, usegmt=True)}
+
+    def __repr__(self):
+        return 'TarballSource({!r})'.format(self.path)
+
+
+def open_source(location, timeout=60):
+    # http(s):// URLs are fetched, file:// URLs and plain paths are read from disk, archives as tarballs.
+    if location.startswith(('http://', 'https://')):
+        return HttpSource(location, timeout)
+    if location.startswith('file://'):
+        location = urllib.request.url2pathname(urllib.parse.urlparse(location).path)
+    if location.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')) or \
+            (os.path.isfile(location) and tarfile.is_tarfile(location)):
+        return TarballSource(location)
+    return DirectorySource(location)
+
+
+def write_file(path, body, modified=None):
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.')
+    with os.fdopen(handle, 'wb') as file:
+        file.write(body)
+    if modified:
+        # A mirror keeps the upstream modification time, which is what DirectorySource reports.
+        timestamp = parsedate_to_datetime(modified).timestamp()
+        os.utime(temporary, (timestamp, timestamp))
+    os.replace(temporary, path)
+
+
+def sync(source, directory, file_names=None):
+    # Mirrors the files of source into directory, downloading only those changed since the last sync.
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, manifestName)
+    try:
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        manifest = {}
+    changed = []
+    for file_name in file_names or upstreamFiles:
+        path = os.path.join(directory, file_name)
+        cached = manifest.get(file_name) if os.path.isfile(path) else None
+        body, validators = source.fetch(file_name, cached)
+        if body is None:
+            continue
+        write_file(path, body, validators.get('modified'))
+        manifest[file_name] = validators
+        changed.append(file_name)
+    write_file(manifest_path, json.dumps(manifest, indent=2).encode())
+    return changed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Data sources of the dashboard.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    mirror = commands.add_parser('sync', help="Mirror the CSSE files into a local directory.")
+    mirror.add_argument('directory')
+    mirror.add_argument('--source', default=os.environ.get('COVID_SOURCE', upstreamURL),
+                        help="URL, directory or tarball to mirror, by default the upstream repository.")
+    mirror.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+    source = open_source(args.source, args.timeout)
+    changed = sync(source, args.directory)
+    print("{} of {} files updated from {!r}.".format(len(changed), len(upstreamFiles), source))
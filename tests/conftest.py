@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_data import write_dataset
+
+# main loads its dataset at import: point it at generated files and a private store before any test imports it.
+fixtureDir = tempfile.mkdtemp(prefix='fixtures-')
+write_dataset(fixtureDir, countries=12, provinces=4, states=5, counties=40, days=60)
+os.environ['COVID_SOURCE'] = fixtureDir
+os.environ['DATA_STORE'] = os.path.join(tempfile.mkdtemp(prefix='store-'), 'allData.arrow')
+os.environ['REFRESH_INTERVAL'] = '0'
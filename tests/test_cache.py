@@ -0,0 +1,36 @@
+import os
+import time
+
+from cache import FigureCache
+
+
+def test_disk_tier_survives_clear_and_restart(tmp_path):
+    cache = FigureCache(directory=str(tmp_path))
+    cache.put(('new', 'US', '<all>', 'abc'), {'data': [1]})
+    cache.clear()
+    restarted = FigureCache(directory=str(tmp_path))
+    assert restarted.get(('new', 'US', '<all>', 'abc')) == {'data': [1]}
+    assert restarted.stats()['disk_hits'] == 1
+
+
+def test_prune_removes_old_entries_only(tmp_path):
+    cache = FigureCache(directory=str(tmp_path))
+    cache.put('old', 1)
+    cache.put('new', 2)
+    old = cache.disk_path('old')
+    os.utime(old, (time.time() - 3600, time.time() - 3600))
+    assert cache.prune(60) == 1
+    assert not os.path.exists(old) and os.path.exists(cache.disk_path('new'))
+
+
+def test_prune_ignores_files_removed_concurrently(tmp_path, monkeypatch):
+    cache = FigureCache(directory=str(tmp_path))
+    cache.put('key', 1)
+    os.utime(cache.disk_path('key'), (0, 0))
+    remove = os.remove
+
+    def remove_twice(path):
+        remove(path)
+        remove(path)
+    monkeypatch.setattr(os, 'remove', remove_twice)
+    assert cache.prune(60) == 0
@@ -0,0 +1,41 @@
+import pytest
+from pandas.testing import assert_frame_equal
+
+from generate_data import global_frames, us_frames
+from loaders import load_data_global, load_data_us, parse_csv
+
+id_columns = {load_data_global: 4, load_data_us: 11}
+
+
+def csv_bytes(frame):
+    return frame.to_csv(index=False).encode()
+
+
+def sorted_frame(data):
+    return data.sort_values(['Country', 'Province/State', 'date']).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('loader, frame', [(load_data_global, global_frames(12, 4, 30)[0]),
+                                           (load_data_us, us_frames(5, 40, 30)[0])])
+def test_incremental_refresh_equals_full_rebuild(loader, frame):
+    earlier = frame.iloc[:, :id_columns[loader] + 25]
+    raw, data, mode = parse_csv(loader, csv_bytes(earlier), 'CumConfirmed')
+    assert mode == 'full'
+    previous = {'raw': raw, 'data': data}
+    raw, incremental, mode = parse_csv(loader, csv_bytes(frame), 'CumConfirmed', previous)
+    assert mode == 'incremental'
+    _, full, _ = parse_csv(loader, csv_bytes(frame), 'CumConfirmed')
+    assert_frame_equal(sorted_frame(incremental), sorted_frame(full))
+    _, unchanged, mode = parse_csv(loader, csv_bytes(frame), 'CumConfirmed', {'raw': raw, 'data': incremental})
+    assert mode == 'unchanged' and unchanged is incremental
+
+
+def test_revised_history_falls_back_to_full_rebuild():
+    frame = global_frames(12, 4, 30)[0]
+    raw, data, _ = parse_csv(load_data_global, csv_bytes(frame.iloc[:, :29]), 'CumConfirmed')
+    revised = frame.copy()
+    revised.iloc[0, 5] += 1
+    _, rebuilt, mode = parse_csv(load_data_global, csv_bytes(revised), 'CumConfirmed', {'raw': raw, 'data': data})
+    assert mode == 'full'
+    assert_frame_equal(sorted_frame(rebuilt),
+                       sorted_frame(parse_csv(load_data_global, csv_bytes(revised), 'CumConfirmed')[1]))
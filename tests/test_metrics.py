@@ -0,0 +1,82 @@
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from metrics import Gauge, Histogram, Registry
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A second worker: records one callback, dumps its metrics and stays alive until stdin is closed.
+worker = """
+import sys
+from metrics import Gauge, Histogram, Registry
+registry = Registry(sys.argv[1], interval=60)
+latency = registry.register(Histogram('callback_seconds', "Callback seconds.", ['callback']))
+registry.register(Gauge('cache_entries', "Cached figures.", lambda: 3, aggregate='sum'))
+registry.register(Gauge('dataset_version', "Dataset version.", lambda: 7, aggregate='pid'))
+latency.observe(0.2, 'update')
+registry.start()
+registry.dump()
+print('ready', flush=True)
+sys.stdin.read()
+"""
+
+
+def registry_in(directory):
+    registry = Registry(directory, interval=60)
+    latency = registry.register(Histogram('callback_seconds', "Callback seconds.", ['callback']))
+    registry.register(Gauge('cache_entries', "Cached figures.", lambda: 2, aggregate='sum'))
+    registry.register(Gauge('dataset_version', "Dataset version.", lambda: 5, aggregate='pid'))
+    return registry, latency
+
+
+def test_metrics_are_aggregated_over_live_processes(tmp_path):
+    registry, latency = registry_in(str(tmp_path))
+    latency.observe(0.01, 'update')
+    other = subprocess.Popen([sys.executable, '-c', worker, str(tmp_path)], cwd=repository, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, text=True, env=dict(os.environ, PYTHONPATH=repository))
+    try:
+        assert other.stdout.readline().strip() == 'ready'
+        text = registry.render()
+        assert 'callback_seconds_count{callback="update"} 2' in text
+        assert 'cache_entries 5' in text
+        assert 'dataset_version{{pid="{}"}} 5'.format(os.getpid()) in text
+        assert 'dataset_version{{pid="{}"}} 7'.format(other.pid) in text
+    finally:
+        other.stdin.close()
+        other.wait(timeout=30)
+    # The file of a process that exited is gone, only this process is left.
+    text = registry.render()
+    assert 'callback_seconds_count{callback="update"} 1' in text
+    assert 'cache_entries 2' in text
+    assert str(other.pid) not in text
+
+
+def test_stale_files_are_removed(tmp_path):
+    registry, _ = registry_in(str(tmp_path))
+    stale = tmp_path / '1-dead.json'
+    stale.write_text('{"cache_entries": [[[], 40]]}')
+    os.utime(stale, (0, 0))
+    assert 'cache_entries 2' in registry.render()
+    assert not stale.exists()
+
+
+def test_removed_directory_is_recreated(tmp_path):
+    directory = tmp_path / 'metrics'
+    registry = Registry(str(directory), interval=0.01)
+    registry.register(Gauge('entries', "Entries.", lambda: 1))
+    registry.start()
+    shutil.rmtree(directory, ignore_errors=True)
+    assert 'entries 1' in registry.render()
+    for _ in range(200):
+        if directory.is_dir() and any(directory.glob('*.json')):
+            break
+        time.sleep(0.01)
+    assert any(directory.glob('*.json'))
+
+
+def test_expiry_follows_the_interval():
+    assert Registry(interval=5).expire == 60
+    assert Registry(interval=120).expire == 360
@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Whether the summary and a profile file are served, without and with the token given as first argument.
+# Dash answers unknown paths with its index page, so a missing route shows in the content, not the status.
+script = """
+import os
+import sys
+import conftest
+import main
+with open(os.path.join(main.profileDir, 'request.prof'), 'w') as file:
+    file.write('profile data')
+client = main.server.test_client()
+headers = {'X-Profile-Token': sys.argv[1]} if len(sys.argv) > 1 else {}
+print(b'profiled requests' in client.get('/profiles').data,
+      b'profiled requests' in client.get('/profiles', headers=headers).data,
+      client.get('/profiles/request.prof', headers=headers).data == b'profile data')
+"""
+
+
+def profile_pages(tmp_path, token=None, sent=None):
+    environment = dict(os.environ, PROFILE_DIR=str(tmp_path / 'profiles'),
+                       PYTHONPATH=os.pathsep.join([repository, os.path.join(repository, 'tests')]))
+    environment.pop('PROFILE_TOKEN', None)
+    if token:
+        environment['PROFILE_TOKEN'] = token
+    result = subprocess.run([sys.executable, '-c', script] + ([sent] if sent else []), cwd=str(tmp_path),
+                            env=environment, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.split()[-3:]
+
+
+def test_profile_pages_are_not_served_without_token(tmp_path):
+    assert profile_pages(tmp_path) == ['False', 'False', 'False']
+
+
+def test_profile_pages_require_token(tmp_path):
+    assert profile_pages(tmp_path, 'secret', 'wrong') == ['False', 'False', 'False']
+    assert profile_pages(tmp_path, 'secret', 'secret') == ['False', 'True', 'True']
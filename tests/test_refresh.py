@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from conftest import fixtureDir
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('method', ['fork', 'spawn', 'forkserver'])
+def test_first_load_with_parse_processes_does_not_hang(tmp_path, method):
+    # No store and no pickle in the working directory: importing main downloads through the process pool.
+    script = "import multiprocessing, sys; multiprocessing.set_start_method(sys.argv[1]); import main; " \
+             "print(len(main.countries))"
+    environment = dict(os.environ, PARSE_PROCESSES='2', DATA_STORE=str(tmp_path / 'store'),
+                       PYTHONPATH=repository)
+    result = subprocess.run([sys.executable, '-c', script, method], cwd=str(tmp_path), env=environment,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    countries = pd.read_csv(os.path.join(fixtureDir, 'time_series_covid19_confirmed_global.csv'))['Country/Region']
+    assert int(result.stdout.split()[-1]) == countries.nunique() + 1  # US comes from the US files.
+
+
+# Like `uvicorn --workers`: the server imports main inside processes it starts through multiprocessing.
+serverScript = """
+import multiprocessing
+import sys
+import threading
+
+
+def serve(queue):
+    import main
+    queue.put((len(main.countries), any(thread.name == 'refresh-data' for thread in threading.enumerate())))
+
+
+if __name__ == '__main__':
+    context = multiprocessing.get_context(sys.argv[1])
+    queue = context.Queue()
+    worker = context.Process(target=serve, args=(queue,))
+    worker.start()
+    print(*queue.get(timeout=120))
+    worker.join()
+"""
+
+
+@pytest.mark.parametrize('method', ['fork', 'spawn'])
+def test_server_workers_started_by_multiprocessing_serve(tmp_path, method):
+    (tmp_path / 'server.py').write_text(serverScript)
+    environment = dict(os.environ, DATA_STORE=str(tmp_path / 'store'), REFRESH_INTERVAL='3600', PYTHONPATH=repository)
+    result = subprocess.run([sys.executable, 'server.py', method], cwd=str(tmp_path), env=environment,
+                            capture_output=True, text=True, timeout=180)
+    assert result.returncode == 0, result.stderr
+    countries, refreshing = result.stdout.split()[-2:]
+    assert int(countries) > 0 and refreshing == 'True'
@@ -0,0 +1,49 @@
+import time
+
+import main
+
+
+def test_stale_snapshot_is_revalidated_at_most_once_per_interval(monkeypatch):
+    started = []
+    monkeypatch.setattr(main, 'snapshotMaxAge', 1)
+    monkeypatch.setattr(main, 'revalidateInterval', 300)
+    monkeypatch.setattr(main, 'lastRevalidation', float('-inf'))
+    monkeypatch.setattr(main, 'snapshot_age', lambda: 3600)
+    monkeypatch.setattr(main, 'revalidate', lambda: (started.append(1), main.revalidating.clear()))
+    snapshot = main.current_snapshot()
+    for _ in range(5):
+        assert main.serve_snapshot() is snapshot
+    deadline = time.monotonic() + 5
+    while main.revalidating.is_set() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert main.serve_snapshot() is snapshot
+    assert len(started) == 1
+
+
+def test_publish_prerenders_without_refresh_loop(monkeypatch):
+    snapshot = main.current_snapshot()
+    country, state = next((c, s) for c, states in snapshot.index.states.items() for s in states)
+    monkeypatch.setattr(main, 'prerenderRegions', [(country, state)])
+    published = main.publish_data(snapshot.data, derived=True, etag=snapshot.etag)
+    deadline = time.monotonic() + 10
+    while main.figureCache.stats()['size'] < len(main.figureKinds) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert main.figureCache.get(('new', country, state, published.etag)) is not None
+
+
+def test_only_existing_regions_are_counted():
+    before = dict(main.regionRequests)
+    main.update_new_figure('Nowhere', 'Nothing', None, None)
+    assert dict(main.regionRequests) == before
+
+
+def test_category_axis_patch_replaces_date_labels():
+    snapshot = main.current_snapshot()
+    country, state = next((c, s) for c, states in snapshot.index.states.items() for s in states)
+    figure = main.barchart(main.filtered_data(country, state, snapshot), main.metricNames, 'New', lean=False)
+    operations = main.figure_patch(figure).to_plotly_json()['operations']
+    locations = [operation['location'] for operation in operations]
+    assert ['layout', 'xaxis', 'ticktext'] in locations and ['layout', 'xaxis', 'tickvals'] in locations
+    lean = main.figure_patch(main.barchart(main.filtered_data(country, state, snapshot), main.metricNames, 'New',
+                                           lean=True)).to_plotly_json()['operations']
+    assert not any(operation['location'][0] == 'layout' for operation in lean)
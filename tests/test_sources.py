@@ -0,0 +1,49 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from sources import HttpSource
+
+body = b"Province/State,Country/Region,Lat,Long,1/22/20\n,Germany,51.0,9.0,1\n"
+
+
+class Handler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Last-Modified', 'Mon, 01 Jun 2020 00:00:00 GMT')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}/data'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_unchanged_file_is_not_downloaded_again(server):
+    source = HttpSource(server, timeout=5)
+    first, validators = source.fetch('confirmed.csv')
+    assert first == body
+    assert validators == {'etag': '"v1"', 'modified': 'Mon, 01 Jun 2020 00:00:00 GMT'}
+    cached = dict(validators, data='parsed')
+    assert source.fetch('confirmed.csv', cached) == (None, cached)
+    assert Handler.requests == [('/data/confirmed.csv', None), ('/data/confirmed.csv', '"v1"')]
@@ -0,0 +1,47 @@
+import logging
+import os
+import time
+
+import pyarrow as pa
+from pandas.testing import assert_frame_equal
+
+import main
+from metrics import Gauge, Registry
+
+
+def test_store_round_trip_is_memory_mapped(tmp_path, caplog):
+    data = main.current_snapshot().data
+    main.write_store(data, 'abc', str(tmp_path))
+    allocated = pa.total_allocated_bytes()
+    with caplog.at_level(logging.INFO, logger='main'):
+        etag, read = main.read_store(str(tmp_path))
+    allocated = pa.total_allocated_bytes() - allocated
+    assert etag == 'abc'
+    assert_frame_equal(read.reset_index(drop=True), data.reset_index(drop=True), check_column_type=False)
+    # Every column, categorical codes included, stays in the mapped file.
+    assert "copied: none." in caplog.text
+    assert allocated < read.memory_usage(index=False).sum() / 100
+
+
+def test_old_layout_is_rewritten(tmp_path):
+    (tmp_path / 'abc').mkdir()
+    (tmp_path / 'abc' / 'US.arrow').write_bytes(b'')
+    (tmp_path / 'CURRENT').write_text('abc')
+    assert main.store_version(str(tmp_path)) is None
+    main.write_store(main.current_snapshot().data, 'abc', str(tmp_path))
+    assert main.store_version(str(tmp_path)) == 'abc'
+    assert not (tmp_path / 'abc' / 'US.arrow').exists()
+
+
+def test_versions_are_kept_next_to_running_metrics(tmp_path):
+    assert os.path.dirname(os.path.abspath(main.metricsDir)) != os.path.abspath(main.dataStore)
+    # Even a metrics directory inside the store, rewritten while versions are written, is left alone.
+    registry = Registry(str(tmp_path / 'metrics'), interval=0.01)
+    registry.register(Gauge('entries', "Entries.", lambda: 1))
+    registry.start()
+    data = main.current_snapshot().data
+    for etag in ['first', 'second', 'third']:
+        time.sleep(0.05)
+        main.write_store(data, etag, str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ['CURRENT', 'metrics', 'second', 'third']
+    assert 'entries 1' in registry.render()